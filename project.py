@@ -3,15 +3,20 @@
 from __future__ import annotations
 
 import abc
+import array
+import bisect
 import collections as col
 import dataclasses as dc
 import datetime as dt
+import difflib
 import itertools as it
 import json
+import mmap
 import os
 import pathlib as p
 import random
 import time
+from typing import Iterator
 
 import colorama
 import more_itertools as mit
@@ -21,6 +26,7 @@ from agave import *
 from termcolor import colored
 
 __all__ = [
+    "CandidateIndex",
     "make_edit_command_line",
     "namespace_of",
     "prettyprint_proposed_edit",
@@ -48,6 +54,8 @@ class Project(abc.ABC):
 
 @dc.dataclass
 class ProjectWithCandidates(Project):
+    candidate_index: Maybe[CandidateIndex] = dc.field(default=Nil, init=False, repr=False)
+
     def get_path(self):
         path = p.Path("project-data") / self.name / "candidates.txt"
         return path
@@ -60,12 +68,194 @@ class ProjectWithCandidates(Project):
         articles_to_fix = map(normalize_article_name, articles_to_fix)
         return list(articles_to_fix)
 
+    def get_index_directory(self):
+        return self.get_path().parent / "index"
+
+    def load_candidate_index(self) -> CandidateIndex:
+        """Load the indexed candidates, rebuilding the index if `candidates.txt` is newer.
+
+        The index is opened once per project. Candidates resolved in a previous index stay
+        resolved when it is rebuilt.
+        """
+        if self.candidate_index:
+            return self.candidate_index.unwrap()
+
+        directory = self.get_index_directory()
+        *_, namespaces_path = CandidateIndex.paths(directory)
+
+        if not namespaces_path.exists():
+            CandidateIndex.build(self.load_candidates(), directory)
+
+        elif namespaces_path.stat().st_mtime < self.get_path().stat().st_mtime:
+            old_index = CandidateIndex.open(directory)
+            resolved_titles = old_index.get_resolved_titles()
+            old_index.close()
+
+            CandidateIndex.build(self.load_candidates(), directory, resolved_titles)
+
+        self.candidate_index = Just(CandidateIndex.open(directory))
+        return self.candidate_index.unwrap()
+
     def mark_candidate_resolved(self, pagename: str):
-        contents = self.load_candidates()
-        contents.remove(pagename)
+        self.load_candidate_index().resolve(pagename)
+
+
+@dc.dataclass
+class CandidateIndex:
+    """A sorted, offset-indexed candidate list.
+
+    Titles are stored sorted by `(namespace_of(title), title)`, one per line. Separate files
+    hold the byte offset of every line, one resolved flag per line and the line range of every
+    namespace, so selecting a namespace, a prefix or a random sample only reads the matching
+    lines through a memory map instead of loading the whole list.
+
+    The index is the source of truth for which candidates are resolved; `candidates.txt` is
+    only read when it changes.
+    """
+
+    titles: mmap.mmap | bytes
+    offsets: memoryview
+    resolved: mmap.mmap | bytearray
+    namespaces: dict[str, range]
+
+    @staticmethod
+    def paths(directory: p.Path) -> tuple[p.Path, p.Path, p.Path, p.Path]:
+        return (
+            directory / "titles.txt",
+            directory / "offsets.bin",
+            directory / "resolved.bin",
+            directory / "namespaces.json",
+        )
+
+    @classmethod
+    def build(cls, titles: [str], directory: p.Path, resolved_titles: {str} = frozenset()):
+        titles_path, offsets_path, resolved_path, namespaces_path = cls.paths(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+
+        titles = sorted(set(titles) - {""}, key=lambda title: (namespace_of(title), title))
+        offsets = array.array("Q", [0])
+        namespaces = {}
+
+        with titles_path.open("wb") as file:
+            for i, title in enumerate(titles):
+                offsets.append(offsets[-1] + file.write(title.encode("utf-8") + b"\n"))
+                namespace = namespace_of(title)
+                namespaces.setdefault(namespace, [i, i])[1] = i + 1
+
+        with offsets_path.open("wb") as file:
+            offsets.tofile(file)
 
-        with self.get_path().open("w", encoding="utf-8") as file:
-            file.write("\n".join(contents))
+        with resolved_path.open("wb") as file:
+            file.write(bytes(title in resolved_titles for title in titles))
+
+        # Written last, since its modification time marks the index as up to date.
+        with namespaces_path.open("w", encoding="utf-8") as file:
+            json.dump(namespaces, file, ensure_ascii=False)
+
+    @classmethod
+    def open(cls, directory: p.Path) -> CandidateIndex:
+        titles_path, offsets_path, resolved_path, namespaces_path = cls.paths(directory)
+
+        def map_file(path, access=mmap.ACCESS_READ):
+            with path.open("rb" if access == mmap.ACCESS_READ else "r+b") as file:
+                # Empty files can't be memory mapped.
+                if not path.stat().st_size:
+                    return bytearray()
+                return mmap.mmap(file.fileno(), 0, access=access)
+
+        with namespaces_path.open("r", encoding="utf-8") as file:
+            namespaces = {key: range(*value) for key, value in json.load(file).items()}
+
+        offsets = memoryview(map_file(offsets_path)).cast("Q")
+        resolved = map_file(resolved_path, access=mmap.ACCESS_WRITE)
+        return cls(map_file(titles_path), offsets, resolved, namespaces)
+
+    def close(self):
+        self.offsets.release()
+
+        for file in (self.titles, self.resolved):
+            if isinstance(file, mmap.mmap):
+                file.close()
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        line = self.titles[self.offsets[i] : self.offsets[i + 1]]
+        return line.decode("utf-8").removesuffix("\n")
+
+    def namespace(self, namespace: str) -> range:
+        """Return the lines of all titles in `namespace`."""
+        return self.namespaces.get(namespace, range(0))
+
+    def with_prefix(self, prefix: str) -> [range]:
+        """Return the lines of all titles starting with `prefix`, one range per namespace."""
+        # A title starting with a prefix containing a colon must share its namespace, while a
+        # colon-free prefix can also be the start of a namespace name.
+        if ":" in prefix:
+            namespaces = [namespace_of(prefix)]
+        else:
+            namespaces = [i for i in self.namespaces if i == "Main" or i.startswith(prefix)]
+
+        result = [self._bisect_prefix(prefix, self.namespace(i)) for i in namespaces]
+        return [lines for lines in result if lines]
+
+    def _bisect_prefix(self, prefix: str, lines: range) -> range:
+        n = len(prefix)
+
+        start = bisect.bisect_left(self, prefix, lines.start, lines.stop, key=lambda t: t[:n])
+        stop = bisect.bisect_right(self, prefix, start, lines.stop, key=lambda t: t[:n])
+        return range(start, stop)
+
+    def find(self, title: str) -> Maybe[int]:
+        """Return the line of `title`, if it is a candidate."""
+        lines = self.namespace(namespace_of(title))
+        i = bisect.bisect_left(self, title, lines.start, lines.stop)
+        return Just(i) if i < lines.stop and self[i] == title else Nil
+
+    def is_resolved(self, i: int) -> bool:
+        return bool(self.resolved[i])
+
+    def resolve(self, title: str):
+        def mark_resolved(i):
+            self.resolved[i] = 1
+            self.resolved.flush()
+
+        self.find(title).map(mark_resolved)
+
+    def get_resolved_titles(self) -> {str}:
+        return {self[i] for i in range(len(self)) if self.is_resolved(i)}
+
+    def iter_titles(self, lines: [int]) -> Iterator[str]:
+        return (self[i] for i in lines if not self.is_resolved(i))
+
+    def sample(self, lines: [int], k: Maybe[int] = Nil) -> Iterator[str]:
+        """Lazily yield `k` random unresolved titles from `lines`, or all of them in random order.
+
+        Titles are read as they are consumed, and resolved titles are skipped at that point.
+        """
+        titles = self.iter_titles(_iter_shuffled(lines))
+        return it.islice(titles, k.unwrap_or(None))
+
+
+def _iter_shuffled(items: [int]) -> Iterator[int]:
+    """Lazily yield `items` in random order.
+
+    Items are drawn one at a time until half of them have been drawn, so taking only a few
+    doesn't shuffle the whole sequence. The rest are then shuffled at once.
+    """
+    drawn = set()
+
+    while len(drawn) < len(items) // 2:
+        i = random.randrange(len(items))
+
+        if i not in drawn:
+            drawn.add(i)
+            yield items[i]
+
+    rest = [item for i, item in enumerate(items) if i not in drawn]
+    random.shuffle(rest)
+    yield from rest
 
 
 @dc.dataclass
@@ -127,6 +317,59 @@ class ProposedEdit:
         assert not any_ranges_overlap(ranges)
         return dc.replace(self, changes=items)
 
+    def rebase(
+        self, source: str, make_proposal: callable
+    ) -> tuple[ProposedEdit, [ProposedEditChange], bool]:
+        """Rebase the edit onto `source`, a newer revision of `self.source`.
+
+        `make_proposal(source)` is run on the whole new text, since a proposal may depend on
+        the whole page. An original change is carried over only if it lies on lines left
+        untouched since `self.source` and the new proposal contains the same change at its new
+        position. Returns the new proposal, the original changes it no longer agrees with, and
+        whether it needs review because it drops, changes or adds anything.
+        """
+        old_lines = self.source.splitlines(keepends=True)
+        new_lines = source.splitlines(keepends=True)
+        old_offsets = [0, *it.accumulate(map(len, old_lines))]
+        new_offsets = [0, *it.accumulate(map(len, new_lines))]
+
+        # Maps the old number of every untouched line to its new number.
+        line_map = {}
+        matcher = difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if tag == "equal":
+                line_map.update(zip(range(i1, i2), range(j1, j2)))
+
+        def shifted(change) -> Maybe[tuple[int, int, str]]:
+            last_line = len(old_lines) - 1
+            first = min(bisect.bisect_right(old_offsets, change.start) - 1, last_line)
+            last = bisect.bisect_right(old_offsets, max(change.start, change.end - 1)) - 1
+            lines = range(first, min(last, last_line) + 1)
+
+            is_untouched = all(i in line_map for i in lines) and (
+                line_map[lines[-1]] - line_map[lines[0]] == len(lines) - 1
+            )
+
+            if not is_untouched:
+                return Nil
+
+            shift = new_offsets[line_map[lines[0]]] - old_offsets[lines[0]]
+            return Just((change.start + shift, change.end + shift, change.new_text))
+
+        rebased = ProposedEdit(source)
+        rebased.changes = [
+            dc.replace(change, parent=rebased)
+            for change in make_proposal(source).changes
+            if not change.is_noop()
+        ]
+
+        proposed = {(i.start, i.end, i.new_text) for i in rebased.changes}
+        carried_over = {shifted(i).unwrap_or(None) for i in self.changes} & proposed
+        conflicts = [i for i in self.changes if shifted(i).unwrap_or(None) not in proposed]
+
+        return rebased, conflicts, bool(conflicts) or carried_over != proposed
+
 
 @dc.dataclass
 class ProposedEditChange:
@@ -307,6 +550,7 @@ class Event:
     debug_context: dict
 
     proposed_edit: Maybe[ProposedEdit] = Nil
+    base_revision: Maybe[int] = Nil
 
 
 @dc.dataclass
@@ -321,6 +565,8 @@ class ProjectExecutor:
 
     backlog: col.deque = dc.field(default_factory=col.deque)
     to_edit: list = dc.field(default_factory=list)
+    # Pages already loaded ahead of `push_edit`, which are used instead of fetching them again.
+    preloaded_pages: dict[str, pywikibot.Page] = dc.field(default_factory=dict)
 
     time_until_edit: Maybe[dt.datetime] = Nil
 
@@ -349,16 +595,78 @@ class ProjectExecutor:
 
             action = self.backlog.popleft()
             proposed_edit, edit_message = action.proposed_edit.unwrap()
-            new_proposed_text = proposed_edit.join()
             page = pywikibot.Page(pywikibot.Site(self.sitename), action.pagename)
 
+            if not page.exists():
+                action.debug_context["action"] = f"{self.project.name}/skip"
+                action.debug_context["reason"] = "deleted-before-save"
+
+                print(f": skipping article {action.pagename!r} (deleted before saving)")
+                self.project.log_action(action.debug_context)
+                self.project.mark_candidate_resolved(action.pagename)
+                continue
+
+            # The page may have been edited since the proposal was made.
+            if action.base_revision != Just(page.latest_revision_id):
+                rebased = self.rebase_edit(action, page, proposed_edit)
+
+                if not rebased:
+                    self.project.log_action(action.debug_context)
+                    self.project.mark_candidate_resolved(action.pagename)
+                    continue
+
+                proposed_edit, edit_message = rebased.unwrap()
+
             self.project.log_action(action.debug_context)
-            self.project.save_page(page, new_proposed_text, edit_message)
+            self.project.save_page(page, proposed_edit.join(), edit_message)
 
             self.time_until_edit = Just(dt.datetime.now() + dt.timedelta(seconds=self.sleep_time))
 
         return Nil
 
+    def rebase_edit(
+        self, action: Event, page: pywikibot.Page, proposed_edit: ProposedEdit
+    ) -> Maybe[tuple[ProposedEdit, str]]:
+        """Rebase an edit onto the current revision of a page which changed since the proposal.
+
+        Approved changes which the new proposal still agrees with are kept as they are. Any
+        dropped, changed or added change sends the edit through manual approval, and the
+        dropped changes are recorded for auditing. Returns Nil to skip the edit.
+        """
+        debug_context = action.debug_context
+        debug_context["rebased-from"] = action.base_revision.unwrap_or(None)
+
+        old_source = proposed_edit.source
+        proposed_edit, conflicts, needs_review = proposed_edit.rebase(
+            page.text, lambda text: self.make_proposal(action.pagename, text)
+        )
+
+        debug_context["rebase-conflicts"] = [
+            {
+                "start": change.start,
+                "end": change.end,
+                "current": old_source[change.start : change.end],
+                "replacement": change.new_text,
+            }
+            for change in conflicts
+        ]
+
+        if proposed_edit.is_noop():
+            debug_context["action"] = f"{self.project.name}/skip"
+            debug_context["reason"] = "no-diff-after-rebase"
+
+            print(f": skipping article {action.pagename!r} (no difference after rebasing)")
+            return Nil
+
+        edit_message = self.get_edit_summary(proposed_edit)
+
+        if needs_review and not self.confirm_proposal(action.pagename, proposed_edit, edit_message):
+            debug_context["action"] = f"{self.project.name}/skip"
+            debug_context["reason"] = "rebase-rejected"
+            return Nil
+
+        return Just((proposed_edit, edit_message))
+
     def main(self):
         next_edit_earliest = Nil
 
@@ -391,7 +699,10 @@ class ProjectExecutor:
         debug_context["sitename"] = self.sitename
 
         os.system("clear")
-        page = pywikibot.Page(pywikibot.Site(self.sitename), pagename)
+        if pagename in self.preloaded_pages:
+            page = self.preloaded_pages.pop(pagename)
+        else:
+            page = pywikibot.Page(pywikibot.Site(self.sitename), pagename)
 
         if not page.exists():
             debug_context["action"] = f"{self.project.name}/skip"
@@ -411,24 +722,38 @@ class ProjectExecutor:
 
         edit_message = self.get_edit_summary(proposal)
 
-        if self.needs_manual_approval(proposal):
-            n_changes = len(proposal.changes)
-            proposal_str = prettyprint_proposed_edit(proposal)
+        if self.needs_manual_approval(proposal) and not self.confirm_proposal(
+            pagename, proposal, edit_message
+        ):
+            debug_context["action"] = f"{self.project.name}/skip"
+            return Event(pagename, self.sitename, debug_context)
 
-            print(proposal_str)
-            print("\n\n")
-            print(f": edit on page {pagename!r} with {n_changes} diffs needs manual approval")
-            print(f": would apply with edit message {edit_message!r}")
-            print(f": [y]es to apply proposal, any other key to skip")
+        debug_context["action"] = f"{self.project.name}/apply-replacement"
 
-            input_confirm_edit = input(": ").casefold()
+        print(f": edit pushed!")
+        return Event(
+            pagename,
+            self.sitename,
+            debug_context,
+            Just((proposal, edit_message)),
+            Just(page.latest_revision_id),
+        )
 
-            if input_confirm_edit != "y":
-                print(": skipping article ([y] not pressed)")
-                debug_context["action"] = f"{self.project.name}/skip"
-                return Event(pagename, self.sitename, debug_context)
+    def confirm_proposal(self, pagename, proposal, edit_message) -> bool:
+        """Ask for manual approval of a proposal on the command line."""
+        n_changes = len(proposal.changes)
+        proposal_str = prettyprint_proposed_edit(proposal)
 
-        debug_context["action"] = f"{self.project.name}/apply-replacement"
+        print(proposal_str)
+        print("\n\n")
+        print(f": edit on page {pagename!r} with {n_changes} diffs needs manual approval")
+        print(f": would apply with edit message {edit_message!r}")
+        print(f": [y]es to apply proposal, any other key to skip")
 
-        print(f": edit pushed!")
-        return Event(pagename, self.sitename, debug_context, Just((proposal, edit_message)))
+        input_confirm_edit = input(": ").casefold()
+
+        if input_confirm_edit != "y":
+            print(": skipping article ([y] not pressed)")
+            return False
+
+        return True
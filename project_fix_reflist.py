@@ -30,12 +30,8 @@ def make_proposal(pagename, text):
 
 project = ProjectWithCandidates("fix-reflist")
 sitename = "wikipedia:sv"
-articles_to_fix = project.load_candidates()
-articles_to_fix = [
-    pagename for pagename in project.load_candidates() if namespace_of(pagename) == "Main"
-]
-
-random.shuffle(articles_to_fix)
+candidates = project.load_candidate_index()
+articles_to_fix = candidates.sample(candidates.namespace("Main"))
 
 
 def main():
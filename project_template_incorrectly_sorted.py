@@ -18,14 +18,34 @@ import os
 import time
 
 
-def make_proposal(pagename, source):
+def get_misplaced_memberships(pagename, source) -> [CategoryMembership]:
     if "/" in pagename:
-        return ProposedEdit(source)
+        return []
 
     supercats = get_supercategories(source)
-    supercats = [i for i in supercats if i.sort_as == Just("*")]
+    return [i for i in supercats if i.sort_as == Just("*")]
+
+
+def make_proposals(pages: dict[str, str]) -> dict[str, ProposedEdit]:
+    """Make proposals for many pages at once, mapping page names to their sources.
+
+    All `|*` memberships are extracted up front so that every distinct category is
+    classified once for the whole batch rather than once per link.
+    """
+    memberships = {
+        pagename: get_misplaced_memberships(pagename, source) for pagename, source in pages.items()
+    }
+    category_names = {i.category_name for supercats in memberships.values() for i in supercats}
+    is_template = are_template_categories(category_names)
+
+    return {
+        pagename: propose_sort_keys(source, memberships[pagename], is_template)
+        for pagename, source in pages.items()
+    }
 
-    to_space, to_omega = partition(lambda x: is_template_category(x.category_name), supercats)
+
+def propose_sort_keys(source, supercats, is_template: dict[str, bool]) -> ProposedEdit:
+    to_space, to_omega = partition(lambda x: is_template[x.category_name], supercats)
 
     to_space = [
         ProposedEditChange(..., *i.match.span(), f"[[{i.category_name}| ]]") for i in to_space
@@ -42,14 +62,45 @@ def make_proposal(pagename, source):
     return proposal
 
 
+_PROPOSALS_CACHE = dict()
+
+
+def make_proposal(pagename, source):
+    """Make a proposal for one page, reusing the one made by `preload_proposals` if any."""
+    key = (pagename, source)
+
+    if key in _PROPOSALS_CACHE:
+        return _PROPOSALS_CACHE.pop(key)
+
+    return make_proposals({pagename: source})[pagename]
+
+
 project = ProjectWithCandidates("fix-template-incorrectly-sorted")
 sitename = "wikipedia:sv"
-articles_to_fix = project.load_candidates()
-articles_to_fix = [
-    pagename for pagename in project.load_candidates() if namespace_of(pagename) == "Mall"
-]
+candidates = project.load_candidate_index()
+articles_to_fix = candidates.sample(candidates.namespace("Mall"))
+
+
+def preload_proposals(pagenames, preloaded_pages: dict, chunk_size=100):
+    """Yield `pagenames`, preloading each chunk and making its proposals in one batch beforehand.
+
+    The preloaded pages are put in `preloaded_pages` for the executor and their proposals are
+    memoized for `make_proposal`, so every page is fetched and classified only once.
+    """
+    site = pywikibot.Site(sitename)
+
+    for chunk in mit.chunked(pagenames, chunk_size):
+        pages = [pywikibot.Page(site, pagename) for pagename in chunk]
+        mit.consume(site.preloadpages(pages))
+
+        sources = {pagename: page.text for pagename, page in zip(chunk, pages)}
+        proposals = make_proposals(sources)
+
+        for pagename, page in zip(chunk, pages):
+            preloaded_pages[pagename] = page
+            _PROPOSALS_CACHE[(pagename, sources[pagename])] = proposals[pagename]
 
-random.shuffle(articles_to_fix)
+        yield from chunk
 
 
 def get_edit_summary(changes):
@@ -58,9 +109,9 @@ def get_edit_summary(changes):
 
 
 def main():
-    ProjectExecutor(
-        project, sitename, make_proposal, get_edit_summary, to_edit=articles_to_fix
-    ).main()
+    executor = ProjectExecutor(project, sitename, make_proposal, get_edit_summary)
+    executor.to_edit = preload_proposals(articles_to_fix, executor.preloaded_pages)
+    executor.main()
 
 
 if __name__ == "__main__":
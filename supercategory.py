@@ -20,6 +20,8 @@ class CategoryMembership:
 
 _RE_CATEGORIES = r"\[\[\s*((?>Kategori|Category)\s*:.*?)(\|.*)?\]\]"
 _TOP_CATEGORIES_CACHE = dict()
+_PARENT_CATEGORIES_CACHE = dict()
+_TEMPLATE_CATEGORY_QUERY = ((("Kategori:Mallar",), ("Kategori:Artiklar",)), "wikipedia:sv")
 
 
 # Values in _TOP_CATEGORIES_CACHE are Nil if they're currently being processed
@@ -37,17 +39,34 @@ def get_supercategories(site_text: str) -> [CategoryMembership]:
     return parent_categories
 
 
+def get_parent_categories(category: str, sitename: str) -> [str]:
+    key = (category, sitename)
+
+    if key not in _PARENT_CATEGORIES_CACHE:
+        site = pywikibot.Site(sitename)
+        category_source = pywikibot.Page(site, category).text
+        _cache_parent_categories(category, category_source, sitename)
+
+    return _PARENT_CATEGORIES_CACHE[key]
+
+
+def _cache_parent_categories(category: str, category_source: str, sitename: str):
+    parent_categories = [i.category_name for i in get_supercategories(category_source)]
+    _PARENT_CATEGORIES_CACHE[(category, sitename)] = parent_categories
+
+
 def get_category_set(category: str, category_sets: tuple[tuple[str]], sitename: str) -> bool:
     """
     Return Just(x) if there exists an index x such that `category` is a subcategory of one of `category_sets[x]`,
     or Nil otherwise.
     """
     key = (category, category_sets, sitename)
-    print(f"Checking {key}")
 
     if key in _TOP_CATEGORIES_CACHE:
         return _TOP_CATEGORIES_CACHE[key]
 
+    print(f"Checking {key}")
+
     for i, categories in enumerate(category_sets):
         if category in categories:
             _TOP_CATEGORIES_CACHE[key] = Just(i)
@@ -56,10 +75,7 @@ def get_category_set(category: str, category_sets: tuple[tuple[str]], sitename:
     else:
         _TOP_CATEGORIES_CACHE[key] = Nil
 
-        site = pywikibot.Site(sitename)
-        category_source = pywikibot.Page(site, category).text
-        parent_categories = [i.category_name for i in get_supercategories(category_source)]
-
+        parent_categories = get_parent_categories(category, sitename)
         result = (get_category_set(c, category_sets, sitename) for c in parent_categories)
         result = mit.first(filter(None, result), Nil)
 
@@ -69,6 +85,83 @@ def get_category_set(category: str, category_sets: tuple[tuple[str]], sitename:
 
 
 def is_template_category(category: str) -> bool:
-    return get_category_set(
-        category, (("Kategori:Mallar",), ("Kategori:Artiklar",)), "wikipedia:sv"
-    ) == Just(0)
+    return get_category_set(category, *_TEMPLATE_CATEGORY_QUERY) == Just(0)
+
+
+def _get_cached_category_set(
+    category: str,
+    category_sets: tuple[tuple[str]],
+    sitename: str,
+    visiting: frozenset = frozenset(),
+) -> tuple[Maybe[int], {str}]:
+    """Resolve `category` like `get_category_set`, using only cached parent categories.
+
+    Returns the result along with the categories which have to be fetched before the result
+    is known. The result is only meaningful once no more categories are missing.
+    """
+    key = (category, category_sets, sitename)
+
+    if key in _TOP_CATEGORIES_CACHE:
+        return _TOP_CATEGORIES_CACHE[key], set()
+
+    for i, categories in enumerate(category_sets):
+        if category in categories:
+            return Just(i), set()
+
+    # Categories currently being visited count as unknown, like in `get_category_set`.
+    if category in visiting:
+        return Nil, set()
+
+    if (category, sitename) not in _PARENT_CATEGORIES_CACHE:
+        return Nil, {category}
+
+    for parent in _PARENT_CATEGORIES_CACHE[(category, sitename)]:
+        result, missing = _get_cached_category_set(
+            parent, category_sets, sitename, visiting | {category}
+        )
+
+        # The first parent with a known set decides, so later parents don't matter yet.
+        if result or missing:
+            return result, missing
+
+    return Nil, set()
+
+
+def get_category_sets(
+    categories: {str}, category_sets: tuple[tuple[str]], sitename: str
+) -> dict[str, Maybe[int]]:
+    """Batch version of `get_category_set` for many categories at once.
+
+    All categories are resolved together from the cached category graph. Every round, the
+    parents still needed by any unresolved category are fetched in a single preload, and
+    categories stop being expanded as soon as their set is known.
+    """
+    site = pywikibot.Site(sitename)
+    unresolved = set(categories)
+
+    while True:
+        missing = {
+            category: _get_cached_category_set(category, category_sets, sitename)[1]
+            for category in unresolved
+        }
+        unresolved = {category for category in unresolved if missing[category]}
+
+        if not unresolved:
+            break
+
+        to_fetch = list(set().union(*missing.values()))
+
+        pages = [pywikibot.Page(site, category) for category in to_fetch]
+        mit.consume(site.preloadpages(pages))
+
+        for category, page in zip(to_fetch, pages):
+            _cache_parent_categories(category, page.text, sitename)
+
+    return {
+        category: get_category_set(category, category_sets, sitename) for category in categories
+    }
+
+
+def are_template_categories(categories: {str}) -> dict[str, bool]:
+    category_sets = get_category_sets(categories, *_TEMPLATE_CATEGORY_QUERY)
+    return {category: result == Just(0) for category, result in category_sets.items()}